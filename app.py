@@ -6,11 +6,18 @@ import os
 from flask import Flask
 from routes.avs_routes import avs_routes
 from utils.limiter import limiter
+from utils.json_provider import FastJSONProvider
+from utils.capture import init_capture
 
 app = Flask(__name__)
+# Encodes ObjectId/datetime natively, routes rely on it to return Mongo documents
+app.json = FastJSONProvider(app)
 app.register_blueprint(avs_routes)
 PORT = os.getenv("PORT")
+# RATELIMIT_ENABLED=false lets scripts/replay_traffic.py drive a local instance
+app.config["RATELIMIT_ENABLED"] = os.getenv("RATELIMIT_ENABLED", "true") != "false"
 limiter.init_app(app)
+init_capture(app)
 
 
 @app.after_request
@@ -0,0 +1,229 @@
+"""
+Routing layer for the addresses collection.
+
+With ADDRESS_PARTITIONING unset every call goes to the single `addresses`
+collection exactly as before. With ADDRESS_PARTITIONING=state each state lives in
+its own `addresses_<ST>` collection with its own indexes: queries that know the
+state only touch that partition, the rest scatter to all partitions in parallel
+and gather the results.
+"""
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from db.connection import db, collection
+from utils.full_state_name import normalize_state
+
+PARTITIONED = os.getenv("ADDRESS_PARTITIONING", "").lower() == "state"
+PARTITION_PREFIX = "addresses_"
+UNKNOWN_PARTITION = "unknown"
+
+# Seconds the list of partition collections is trusted before asking Mongo again,
+# this bounds how long a partition created by another worker stays invisible here
+PARTITION_LIST_TTL = float(os.getenv("PARTITION_LIST_TTL", 5))
+# Least seconds between forced refreshes, so unknown states cannot hammer Mongo
+PARTITION_REFRESH_INTERVAL = 1.0
+
+_scatter_pool = ThreadPoolExecutor(max_workers=int(os.getenv("SCATTER_WORKERS", 8)))
+_lock = threading.Lock()
+_indexed = set()
+_partition_names = {"names": set(), "checked": None}
+
+
+def partition_name(state):
+    return PARTITION_PREFIX + (normalize_state(state) or UNKNOWN_PARTITION)
+
+
+def ensure_indexes(target):
+    """Create the indexes every address collection needs, once per process."""
+    if target.name in _indexed:
+        return
+    target.create_index([("addressLine1", "text")])
+    target.create_index("referenceId")
+    with _lock:
+        _indexed.add(target.name)
+        _partition_names["names"].add(target.name)
+
+
+def collection_for_state(state):
+    """
+    Collection that stores addresses of `state`, created with its indexes if needed.
+    Only for writes; reads go through route() so they never create a partition.
+    """
+    if not PARTITIONED:
+        return collection
+    target = db[partition_name(state)]
+    ensure_indexes(target)
+    return target
+
+
+def _known_partitions(refresh=False):
+    """Names of the existing partitions, re-listed after the TTL or on `refresh`."""
+    now = time.monotonic()
+    with _lock:
+        checked = _partition_names["checked"]
+        fresh = checked is not None and now - checked < PARTITION_LIST_TTL
+        if refresh:
+            fresh = checked is not None and now - checked < PARTITION_REFRESH_INTERVAL
+        if fresh:
+            return set(_partition_names["names"])
+
+    names = set(
+        db.list_collection_names(filter={"name": {"$regex": "^" + PARTITION_PREFIX}})
+    )
+    with _lock:
+        _partition_names["names"] = names
+        _partition_names["checked"] = now
+    return set(names)
+
+
+def all_collections(refresh=False):
+    """Every address collection; the existing partitions when partitioned."""
+    if not PARTITIONED:
+        return [collection]
+    return [db[name] for name in sorted(_known_partitions(refresh))]
+
+
+def route(query, state=None):
+    """
+    Existing collections a read has to visit. `state` is a routing hint for queries
+    that do not filter on stateProv themselves; otherwise the query's stateProv is
+    used. A state without a partition routes nowhere.
+    """
+    if not PARTITIONED:
+        return [collection]
+    state = state or query.get("stateProv")
+    if not isinstance(state, str):
+        return all_collections()
+
+    name = partition_name(state)
+    if name in _known_partitions() or name in _known_partitions(refresh=True):
+        return [db[name]]
+    return []
+
+
+def _scatter(func, targets):
+    if len(targets) == 1:
+        return [func(targets[0])]
+    return list(_scatter_pool.map(func, targets))
+
+
+def _unseen(targets, state, query):
+    """Partitions created after `targets` were listed, e.g. by another worker."""
+    if not PARTITIONED or isinstance(state or query.get("stateProv"), str):
+        return []
+    seen = {target.name for target in targets}
+    return [t for t in all_collections(refresh=True) if t.name not in seen]
+
+
+def find_one(query, projection=None, state=None, **kwargs):
+    def lookup(targets):
+        for document in _scatter(
+            lambda target: target.find_one(query, projection, **kwargs), targets
+        ):
+            if document is not None:
+                return document
+        return None
+
+    targets = route(query, state)
+    document = lookup(targets)
+    if document is None:
+        # A miss may be an address in a partition this worker has not listed yet
+        document = lookup(_unseen(targets, state, query))
+    return document
+
+
+def _text_score_field(sort):
+    """Field a sort list orders by text score, e.g. "score", or None."""
+    if isinstance(sort, list):
+        for field, direction in sort:
+            if direction == {"$meta": "textScore"}:
+                return field
+    return None
+
+
+def find(query, projection=None, sort=None, limit=0, state=None, **kwargs):
+    """
+    Run a find on every routed collection and return the documents as a list.
+
+    `sort` takes a field name (ascending) or a pymongo sort list. Results from
+    several partitions are re-sorted on a field name or on the text score, then
+    cut to `limit`; other sort lists are applied per partition only.
+    """
+    targets = route(query, state)
+    score_field = _text_score_field(sort) if len(targets) > 1 else None
+    projected, added_score = projection, False
+    if score_field and score_field not in (projection or {}):
+        # Partitions are merged by text score, so every document has to carry it
+        projected = {**(projection or {}), score_field: {"$meta": "textScore"}}
+        added_score = True
+
+    def run(target):
+        cursor = target.find(query, projected, **kwargs)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        return list(cursor)
+
+    results = _scatter(run, targets)
+    if len(results) == 1:
+        return results[0]
+
+    documents = [document for result in results for document in result]
+    if isinstance(sort, str):
+        # Missing values first, like Mongo's ascending sort on one collection
+        documents.sort(key=lambda doc: (doc.get(sort) is not None, doc.get(sort)))
+    elif score_field:
+        documents.sort(key=lambda doc: doc.get(score_field, 0), reverse=True)
+    documents = documents[:limit] if limit else documents
+    if added_score:
+        for document in documents:
+            document.pop(score_field, None)
+    return documents
+
+
+def count_documents(query, state=None):
+    return sum(
+        _scatter(lambda target: target.count_documents(query), route(query, state))
+    )
+
+
+def insert_one(document):
+    return collection_for_state(document.get("stateProv")).insert_one(document)
+
+
+def find_one_and_delete(query, state=None):
+    targets = route(query, state)
+    for target in targets:
+        document = target.find_one_and_delete(query)
+        if document is not None:
+            return document
+    for target in _unseen(targets, state, query):
+        document = target.find_one_and_delete(query)
+        if document is not None:
+            return document
+    return None
+
+
+def update_one(query, fields, current):
+    """
+    $set `fields` on the document matched by `query`. `current` is the stored
+    document; when the update changes its state it moves to the new partition.
+    """
+    source = collection_for_state(current.get("stateProv"))
+    if "stateProv" not in fields:
+        return source.update_one(query, {"$set": fields})
+
+    destination = collection_for_state(fields["stateProv"])
+    if destination.name == source.name:
+        return source.update_one(query, {"$set": fields})
+
+    result = destination.insert_one({**current, **fields})
+    source.delete_one({"_id": current["_id"]})
+    return result
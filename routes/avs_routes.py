@@ -3,19 +3,38 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-from flask import Blueprint, request, Response, jsonify, abort
-from db.connection import collection, api_key_collection
-from pymongo.errors import PyMongoError
+from flask import Blueprint, request, Response, jsonify, abort, g
+from db.connection import api_key_collection
+from db import partitions
+from pymongo.errors import PyMongoError, ExecutionTimeout
 from utils import AddressSchema, state_names, misc_abbreviation, generate_api_key, auth
 from datetime import datetime
 from io import StringIO
 from utils.limiter import limiter
+from utils.usage import usage, usage_collection
+from utils.etag import (
+    current_version,
+    bump_version,
+    make_etag,
+    get_cached_listing,
+    cache_listing,
+)
+from utils.budget import (
+    request_budget,
+    remaining_ms,
+    near_match_slots,
+    near_match_latency,
+    NEAR_MATCH_LIMIT,
+    NEAR_MATCH_TRUNCATED_LIMIT,
+    EXACT_MATCH_MIN_MS,
+)
 from bson import ObjectId
 from functools import wraps
 from fuzzywuzzy import fuzz
-import copy
 import csv
+import json
 import re
+import time
 
 avs_routes = Blueprint("avs_routes", __name__)
 
@@ -64,14 +83,25 @@ def require_api_key(func):
         if not api_key:
             return jsonify(error_message), 401
 
-        if not api_key_collection.find_one({"api_key": api_key}):
+        key_document = api_key_collection.find_one({"api_key": api_key})
+        if not key_document:
             error_message = {
                 "error": "Invalid API key - Unauthorized access",
                 "fail_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "status": "failure",
             }
             return jsonify(error_message), 401
-        return func(*args, **kwargs)
+
+        # Optional per key latency budget, picked up by request_budget
+        g.api_key_budget_ms = key_document.get("budget_ms")
+        response = func(*args, **kwargs)
+
+        # In-memory counter only, flushed to Mongo in the background
+        status = response[1] if isinstance(response, tuple) else response.status_code
+        usage.record(
+            api_key, request.endpoint, g.get("usage_outcome", f"http_{status}")
+        )
+        return response
 
     return validate_api_key
 
@@ -79,10 +109,10 @@ def require_api_key(func):
 @avs_routes.route("/api/v1/verify", methods=["POST"])
 @limiter.limit("30/hour")
 @require_api_key
+@request_budget
 def verify_address():
     try:
         client_data = request.get_json()
-        client_address_data_response = copy.deepcopy(client_data)
         no_recommendation_q_val = request.args.get("nr")
 
         if not isinstance(client_data.get("addressLine1"), str):
@@ -132,7 +162,31 @@ def verify_address():
             "country": country,
         }
 
-        VALID_ADDRESS = collection.find_one(db_query, {"_id": 0})
+        try:
+            # The exact lookup is the verification itself, so it keeps a floor
+            # instead of failing once near-match style budgets run out
+            VALID_ADDRESS = partitions.find_one(
+                db_query,
+                {"_id": 0},
+                max_time_ms=max(remaining_ms(), EXACT_MATCH_MIN_MS),
+            )
+        except ExecutionTimeout:
+            g.usage_outcome = "timeout"
+            return (
+                jsonify(
+                    {
+                        "avsAddressDetails": {
+                            "responseStatus": False,
+                            "degraded": True,
+                            "address": client_data,
+                            "msg": "verification timed out, please retry",
+                        }
+                    }
+                ),
+                503,
+            )
+        # Set when near-match work is skipped or truncated to stay within budget
+        degraded = False
 
         if VALID_ADDRESS:
             # dict to store recommendations
@@ -144,8 +198,8 @@ def verify_address():
                 if word.lower() in misc_abbreviation:
                     client_addressLine1[idx] = misc_abbreviation[word.lower()]
 
-            client_data["addressLine1"] = " ".join(client_addressLine1)
-            recommendations["addressLine1"] = client_data["addressLine1"].upper()
+            # Kept out of client_data, which is echoed back unchanged as "address"
+            recommendations["addressLine1"] = " ".join(client_addressLine1).upper()
 
             if len(client_data["postalCode"]) == 5:
                 # TODO: integrate with postgrid api for the last four
@@ -183,7 +237,8 @@ def verify_address():
                     "addressVerified": True,
                     "avsResponseCode": 100,
                     "avsResponseDecision": "Success",
-                    "address": client_address_data_response,
+                    "degraded": degraded,
+                    "address": client_data,
                     "recommendedAddresses": {"recommendedAddress": recommendations},
                 }
             }
@@ -197,28 +252,78 @@ def verify_address():
                 "country": country,
             }
 
-            near_match_result = collection.find(db_query, {"_id": 0})
-            near_match_list = list(near_match_result)
-            is_near_match_list = len(near_match_list) > 0
-
-            if is_near_match_list:
-                # Sort the results by similarity score
-                near_match = [
-                    addr
-                    for addr in near_match_list
-                    if fuzz.partial_ratio(
-                        client_data["addressLine1"], addr["addressLine1"]
+            near_match_list = []
+            budget_left = remaining_ms()
+            # Only rank near matches if a slot is free and the budget covers the
+            # typical near-match latency; otherwise answer with the verification alone
+            slot = near_match_slots.acquire() if budget_left > 0 else None
+            if slot is not None:
+                try:
+                    # Candidates are always capped, best text matches first
+                    sort = [("score", {"$meta": "textScore"})]
+                    limit = NEAR_MATCH_LIMIT
+                    if budget_left < near_match_latency.percentile(90):
+                        degraded = True
+                        limit = NEAR_MATCH_TRUNCATED_LIMIT
+                    started = time.monotonic()
+                    # With ADDRESS_PARTITIONING=state this searches the client's state
+                    # first and the whole country only if the state has no match;
+                    # unpartitioned it always searches the whole country
+                    near_match_list = partitions.find(
+                        db_query,
+                        {"_id": 0},
+                        sort=sort,
+                        limit=limit,
+                        state=processed_state_prov,
+                        max_time_ms=budget_left,
+                    )
+                    if (
+                        not near_match_list
+                        and partitions.PARTITIONED
+                        and processed_state_prov
+                    ):
+                        near_match_list = partitions.find(
+                            db_query,
+                            {"_id": 0},
+                            sort=sort,
+                            limit=limit,
+                            max_time_ms=max(remaining_ms(), 1),
+                        )
+                    if not degraded:
+                        # Only full searches feed the estimate, truncated ones would
+                        # skew it low; old samples expire so it cannot stay stuck high
+                        near_match_latency.observe(
+                            (time.monotonic() - started) * 1000
+                        )
+                except ExecutionTimeout:
+                    # Not a completed search, its real latency is unknown
+                    degraded = True
+                    near_match_list = []
+                finally:
+                    near_match_slots.release(slot)
+            else:
+                degraded = True
+
+            near_match = []
+            if near_match_list and remaining_ms() > 0:
+                # Sort the results by similarity score, scoring each candidate once
+                scored = [
+                    (
+                        fuzz.partial_ratio(
+                            client_data["addressLine1"], addr["addressLine1"]
+                        ),
+                        addr,
                     )
-                    >= 30
+                    for addr in near_match_list
                 ]
-                near_match = sorted(
-                    near_match,
-                    key=lambda x: fuzz.partial_ratio(
-                        client_data["addressLine1"], x["addressLine1"]
-                    ),
-                    reverse=True,
-                )
-
+                scored.sort(key=lambda item: item[0], reverse=True)
+                near_match = [addr for score, addr in scored if score >= 30]
+            elif near_match_list:
+                # Budget spent: keep Mongo's text score order rather than ranking
+                degraded = True
+                near_match = near_match_list
+
+            if near_match:
                 # print('--- near match ------------------', near_match)
 
                 # for address in near_match_list:
@@ -268,15 +373,24 @@ def verify_address():
                     "addressVerified": False,
                     "avsResponseCode": 100,
                     "avsResponseDecision": "Failure",
+                    "degraded": degraded,
                     "address": client_data,
                     "nearMatchAddressRecommendation": failed_address_recommendation
-                    or {"msg": "no recommendation for the address submitted"},
+                    or {
+                        "msg": "near match recommendation skipped, request over latency budget"
+                        if degraded
+                        else "no recommendation for the address submitted"
+                    },
                 }
             }
 
             if no_recommendation_q_val and no_recommendation_q_val.lower() == "f":
                 response["avsAddressDetails"].pop("nearMatchAddressRecommendation")
 
+        if VALID_ADDRESS:
+            g.usage_outcome = "verified"
+        else:
+            g.usage_outcome = "not_verified_degraded" if degraded else "not_verified"
         return jsonify(response), 200
     except PyMongoError as e:
         return jsonify({"error": f"Database error: {str(e)}"}), 500
@@ -305,6 +419,7 @@ def verify_address():
 @avs_routes.route("/api/v1/addresses", methods=["GET"])
 @limiter.limit("15/hour")  # This limit requests per hour to 15 for now
 @auth.login_required
+@request_budget(default_ms=None)
 def get_list_of_addresses():
     """
     Retrieves a list of addresses from the database based on the query parameters specified in the request.
@@ -340,6 +455,10 @@ def get_list_of_addresses():
         postalCode = request.args.get("postalcode")
         country = request.args.get("country")
         limit = request.args.get("limit", type=int)
+        if limit:
+            # Mongo treats a negative limit as its absolute value, the partition
+            # merge slices by it, so normalize it here
+            limit = abs(limit)
         address_id = request.args.get("id")
         referenceId = request.args.get("ref_id")
         format = request.args.get("format")
@@ -387,32 +506,60 @@ def get_list_of_addresses():
             else:
                 return jsonify({"Message": "Invalid sort field"}), 400
 
+        # Polling clients resend the same query: answer from the ETag or the
+        # serialized body cache while the collection version is unchanged
+        query_key = json.dumps(
+            {
+                "query": query,
+                "sort": sort_key,
+                "limit": limit,
+                "id": address_id,
+                "format": format.lower() if format else None,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        etag = make_etag(query_key, current_version())
+
+        # Only a client that was sent this exact ETag skips the query; "*" has to
+        # wait until the query is known to have a representation
+        if request.if_none_match.is_strong(etag):
+            return _not_modified(etag)
+
+        cached = get_cached_listing(query_key, etag)
+        if cached:
+            if request.if_none_match.contains(etag):
+                return _not_modified(etag)
+            body, mimetype = cached
+            cached_response = Response(body, mimetype=mimetype)
+            cached_response.set_etag(etag)
+            return cached_response
+
+        # Unbudgeted unless ENDPOINT_BUDGETS_MS sets one; 0 would mean no limit
+        # to Mongo, so an exhausted budget still gets 1ms
+        max_time_ms = max(remaining_ms(), 1) if g.get("deadline") else None
+
         if address_id:
             if ObjectId.is_valid(address_id):
-                address = collection.find_one({"_id": ObjectId(address_id)}, {"_id": 0})
+                address = partitions.find_one(
+                    {"_id": ObjectId(address_id)}, {"_id": 0}, max_time_ms=max_time_ms
+                )
                 if address:
-                    return jsonify(address), 200
+                    return _cacheable_listing(jsonify(address), query_key, etag)
                 else:
                     return jsonify({"Message": "Address not found"}), 404
             else:
                 return jsonify({"Message": "Invalid address ID"}), 400
 
-        elif limit:
-            if sort_key:
-                addresses = list(
-                    collection.find(query, {"_id": 0}).sort(sort_key).limit(limit)
-                )
-            else:
-                addresses = list(collection.find(query, {"_id": 0}).limit(limit))
-
         else:
             # If no limit or address ID is specified, return up to 30 addresses
-            if sort_key:
-                addresses = list(
-                    collection.find(query, {"_id": 0}).sort(sort_key).limit(30)
-                )
-            else:
-                addresses = list(collection.find(query, {"_id": 0}).limit(30))
+            addresses = partitions.find(
+                query,
+                {"_id": 0},
+                sort=sort_key,
+                limit=limit or 30,
+                max_time_ms=max_time_ms,
+            )
 
         if format and format.lower() == "csv":
             output = StringIO()
@@ -420,19 +567,38 @@ def get_list_of_addresses():
             writer.writeheader()
             for address in addresses:
                 writer.writerow(address)
-            return Response(output.getvalue(), mimetype="text/csv")
+            return _cacheable_listing(
+                Response(output.getvalue(), mimetype="text/csv"), query_key, etag
+            )
 
         if addresses:
-            return jsonify(addresses), 200
+            return _cacheable_listing(jsonify(addresses), query_key, etag)
         else:
             return jsonify({"Message": "Address not found"}), 404
 
+    except ExecutionTimeout:
+        return jsonify({"message": "Listing timed out, please retry"}), 503
     except PyMongoError as e:
         return jsonify({"message": "Database error: {}".format(str(e))}), 500
     except Exception as e:
         return jsonify({"message": str(e)}), 500
 
 
+def _cacheable_listing(response, query_key, etag):
+    """Tag a successful listing response with its ETag and keep its body for repeat polls."""
+    cache_listing(query_key, etag, response.get_data(), response.mimetype)
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+    response.set_etag(etag)
+    return response, 200
+
+
+def _not_modified(etag):
+    not_modified = Response(status=304)
+    not_modified.set_etag(etag)
+    return not_modified
+
+
 # --------------------------------------  POST /api/v1/address/ ---------------------------------------------
 
 
@@ -457,7 +623,7 @@ def create_new_address():
         if errors:
             return jsonify({"message": "Invalid address data", "errors": errors}), 400
 
-        if collection.count_documents(client_data) > 0:
+        if partitions.count_documents(client_data) > 0:
             return (
                 jsonify(
                     {
@@ -492,13 +658,13 @@ def create_new_address():
             "stateProv": c_state_prov,
         }
 
-        result = collection.insert_one(data_to_store)
-        new_address = collection.find_one({"_id": result.inserted_id})
-        new_address["_id"] = str(new_address["_id"])
+        partitions.insert_one(data_to_store)
+        bump_version()
 
+        # insert_one sets _id on data_to_store, no need to read the document back
         client_success_response = {
             "time_created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "newly_created_address": new_address,
+            "newly_created_address": data_to_store,
             "status": "success",
         }
 
@@ -535,7 +701,7 @@ def update_address(address_id):
         return jsonify({"message": "Invalid address data", "errors": errors}), 400
 
     query = {"referenceId": int(address_id)}
-    db_query_result = collection.find_one(query)
+    db_query_result = partitions.find_one(query)
 
     if db_query_result is None:
         return (
@@ -545,8 +711,10 @@ def update_address(address_id):
 
     try:
         old_address = db_query_result
-        collection.update_one(query, {"$set": client_data})
-        updated_address = collection.find_one(query)
+        partitions.update_one(query, client_data, old_address)
+        bump_version()
+        # $set on top level fields is a dict merge, no need to read the document back
+        updated_address = {**old_address, **client_data}
 
         succesful_update_message = {
             "message": "Address Updated successfully",
@@ -555,14 +723,6 @@ def update_address(address_id):
             "old_address": old_address,
             "new_address": updated_address,
         }
-
-        # ObjectId not serializable: convert the ObjectId to string
-        succesful_update_message["old_address"]["_id"] = str(
-            succesful_update_message["old_address"]["_id"]
-        )
-        succesful_update_message["new_address"]["_id"] = str(
-            succesful_update_message["new_address"]["_id"]
-        )
         return jsonify(succesful_update_message), 200
 
     except PyMongoError as e:
@@ -596,23 +756,69 @@ def delete_address(address_id):
     else:
         query = {"referenceId": int(address_id)}
 
-    if collection.count_documents(query) == 0:
-        return jsonify({"message": "Address not found"}), 404
-
     try:
-        _document = collection.find_one(query)
-        successful_deletion_message["deleted_address"] = _document
-        successful_deletion_message["deleted_address"]["_id"] = str(
-            successful_deletion_message["deleted_address"]["_id"]
-        )
-        db_query_result = collection.delete_one(query)
+        # One round trip: find_one_and_delete returns the removed document
+        _document = partitions.find_one_and_delete(query)
+        if _document is None:
+            return jsonify({"message": "Address not found"}), 404
 
-        if db_query_result.deleted_count == 1:
-            return jsonify(successful_deletion_message), 200
-        else:
-            return jsonify({"message": "Error deleting address"}), 500
+        bump_version()
+        successful_deletion_message["deleted_address"] = _document
+        return jsonify(successful_deletion_message), 200
 
     except PyMongoError as e:
         return jsonify({"message": "Database error: {}".format(str(e))}), 500
     except Exception as e:
         return jsonify({"message": "Error deleting address", "error": str(e)}), 500
+
+
+# --------------------------------------  GET /api/v1/usage ---------------------------------------------
+
+
+@avs_routes.route("/api/v1/usage", methods=["GET"])
+@limiter.limit("60/hour")
+@auth.login_required
+def get_api_key_usage():
+    """
+    Per API key usage for billing and quotas, one entry per key, endpoint and day.
+
+    Query Parameters:
+
+        key (str): only usage of this API key
+        endpoint (str): only usage of this endpoint, e.g. avs_routes.verify_address
+        from (str): first day to include, YYYY-MM-DD (UTC)
+        to (str): last day to include, YYYY-MM-DD (UTC)
+
+    Counts are flushed from each worker every USAGE_FLUSH_INTERVAL seconds, so the
+    most recent requests may not be included yet.
+    """
+    try:
+        query = {}
+        if request.args.get("key"):
+            query["api_key"] = request.args.get("key")
+        if request.args.get("endpoint"):
+            query["endpoint"] = request.args.get("endpoint")
+
+        day_range = {}
+        for param, operator in (("from", "$gte"), ("to", "$lte")):
+            value = request.args.get(param)
+            if value:
+                try:
+                    datetime.strptime(value, "%Y-%m-%d")
+                except ValueError:
+                    return jsonify({"message": f"Invalid {param} date"}), 400
+                day_range[operator] = value
+        if day_range:
+            query["day"] = day_range
+
+        entries = list(usage_collection.find(query, {"_id": 0}).sort("day"))
+        totals = {}
+        for entry in entries:
+            totals[entry["api_key"]] = totals.get(entry["api_key"], 0) + entry["total"]
+
+        return jsonify({"usage": entries, "totals": totals, "status": "success"}), 200
+
+    except PyMongoError as e:
+        return jsonify({"message": "Database error: {}".format(str(e))}), 500
+    except Exception as e:
+        return jsonify({"message": str(e)}), 500
@@ -0,0 +1,92 @@
+"""
+Compare index size and query latency of the single collection and its partitions.
+
+Usage:
+    python -m scripts.bench_partitions [--samples 50]
+
+Run after scripts.partition_addresses, while the `addresses` collection still
+exists. For every partition it prints document count, total and text index
+size, and the median latency of an exact verify lookup and a $text near-match
+search against the single collection and against the partition.
+"""
+
+import argparse
+import re
+import statistics
+import sys
+import time
+
+from db.connection import db, collection
+from db.partitions import PARTITION_PREFIX
+
+
+def index_sizes(name):
+    stats = db.command("collStats", name)
+    text_index = sum(
+        size for index, size in stats["indexSizes"].items() if index.endswith("_text")
+    )
+    return stats["count"], stats["totalIndexSize"], text_index
+
+
+def median_ms(func, queries):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings) if timings else 0.0
+
+
+def exact_query(doc):
+    # Same shape as verify_address's exact lookup
+    return {
+        "addressLine1": {"$regex": re.escape(doc["addressLine1"]), "$options": "i"},
+        "city": doc.get("city"),
+        "stateProv": doc.get("stateProv"),
+        "postalCode": doc.get("postalCode"),
+    }
+
+
+def text_query(doc):
+    # Same shape as verify_address's near-match search
+    return {"$text": {"$search": doc["addressLine1"]}, "country": doc.get("country")}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--samples", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    names = sorted(
+        db.list_collection_names(filter={"name": {"$regex": "^" + PARTITION_PREFIX}})
+    )
+    count, total_index, text_index = index_sizes(collection.name)
+    print(f"single collection: {count} docs, index {total_index} B, text {text_index} B")
+    print(
+        f"{'partition':<20}{'docs':>10}{'index B':>14}{'text B':>14}"
+        f"{'exact ms':>20}{'text ms':>20}"
+    )
+    print(f"{'':<58}{'single/partition':>20}{'single/partition':>20}")
+
+    for name in names:
+        partition = db[name]
+        docs = list(partition.aggregate([{"$sample": {"size": args.samples}}]))
+        exact = [exact_query(doc) for doc in docs]
+        text = [text_query(doc) for doc in docs]
+
+        single_exact = median_ms(collection.find_one, exact)
+        partition_exact = median_ms(partition.find_one, exact)
+        single_text = median_ms(lambda q: list(collection.find(q)), text)
+        partition_text = median_ms(lambda q: list(partition.find(q)), text)
+
+        count, total_index, text_index = index_sizes(name)
+        print(
+            f"{name:<20}{count:>10}{total_index:>14}{text_index:>14}"
+            f"{f'{single_exact:.1f}/{partition_exact:.1f}':>20}"
+            f"{f'{single_text:.1f}/{partition_text:.1f}':>20}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+Microbenchmark of per-request allocations and serialization time.
+
+Usage:
+    python -m scripts.bench_serialization [--iterations 20000]
+
+Compares Flask's stdlib JSON provider with FastJSONProvider on a verify
+response (with and without the old deepcopy of the request body) and on a
+30 address listing response. No database is needed.
+"""
+
+import argparse
+import copy
+import sys
+import time
+import tracemalloc
+
+from bson import ObjectId
+from flask import Flask, jsonify
+from flask.json.provider import DefaultJSONProvider
+
+from utils.json_provider import FastJSONProvider
+
+CLIENT_DATA = {
+    "addressLine1": "4500 Due West Road NW",
+    "addressLine2": None,
+    "city": "Marietta",
+    "stateProv": "Georgia",
+    "postalCode": "30064",
+    "country": "United States",
+}
+
+
+def verify_response(client_data, deepcopy):
+    # Mirrors the response verify_address builds on an exact match
+    echoed = copy.deepcopy(client_data) if deepcopy else client_data
+    return {
+        "avsAddressDetails": {
+            "responseStatus": True,
+            "addressVerified": True,
+            "avsResponseCode": 100,
+            "avsResponseDecision": "Success",
+            "degraded": False,
+            "address": echoed,
+            "recommendedAddresses": {
+                "recommendedAddress": {
+                    "addressLine1": "4500 DUE W RD NW",
+                    "postalCode": "30064-1234",
+                    "stateProv": "GA",
+                    "country": "US",
+                    "city": "MARIETTA",
+                    "addressLine2": None,
+                }
+            },
+        }
+    }
+
+
+def listing_response():
+    return [
+        {
+            "_id": ObjectId(),
+            "addressLine1": f"{100 + i} Main St",
+            "addressLine2": None,
+            "city": "Houston",
+            "country": "US",
+            "postalCode": "77002-1234",
+            "referenceId": i,
+            "stateProv": "TX",
+        }
+        for i in range(30)
+    ]
+
+
+def measure(app, build, iterations):
+    """Return (microseconds, peak bytes allocated) per request for build + jsonify."""
+    with app.app_context():
+        for _ in range(100):
+            jsonify(build())
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            jsonify(build())
+        elapsed = time.perf_counter() - start
+
+        samples = min(iterations, 1000)
+        peak_total = 0
+        tracemalloc.start()
+        for _ in range(samples):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            jsonify(build())
+            peak_total += tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+
+    return elapsed / iterations * 1e6, peak_total / samples
+
+
+def stdlib_listing_response():
+    # Flask's stdlib provider cannot encode ObjectId, convert like the old routes did
+    addresses = listing_response()
+    for address in addresses:
+        address["_id"] = str(address["_id"])
+    return addresses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    stdlib_app = Flask("stdlib")
+    stdlib_app.json = DefaultJSONProvider(stdlib_app)
+    fast_app = Flask("fast")
+    fast_app.json = FastJSONProvider(fast_app)
+
+    cases = [
+        (
+            "verify, stdlib + deepcopy",
+            stdlib_app,
+            lambda: verify_response(CLIENT_DATA, True),
+        ),
+        (
+            "verify, fast, no copy",
+            fast_app,
+            lambda: verify_response(CLIENT_DATA, False),
+        ),
+        ("listing, stdlib", stdlib_app, stdlib_listing_response),
+        ("listing, fast", fast_app, listing_response),
+    ]
+
+    print(f"{'case':<28}{'us/request':>12}{'peak B/request':>18}")
+    for name, app, build in cases:
+        micros, alloc = measure(app, build, args.iterations)
+        print(f"{name:<28}{micros:>12.2f}{alloc:>18.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
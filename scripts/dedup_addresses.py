@@ -0,0 +1,344 @@
+"""
+Offline near-duplicate detection for the addresses collection.
+
+Usage:
+    python -m scripts.dedup_addresses                      # dry run, prints a summary
+    python -m scripts.dedup_addresses --report dups.jsonl  # dry run, writes every cluster
+    python -m scripts.dedup_addresses --apply              # keeps one address per cluster
+
+Candidates are blocked by (stateProv, zip5, house number, pre- and
+post-directional, street suffix, unit, any other numbers in the address), so
+"123 Main St" and "124 Main St", "123 N Main St" and "123 S Main St" or "Apt 1"
+and "Apt 12" are never compared. Only the street name is scored, with
+rapidfuzz's vectorized `cdist`, and the blocks are spread over a process pool,
+which keeps the job roughly linear in the size of the collection.
+
+Matches are not chained: every duplicate is within the threshold of the row
+that is kept, and rows whose referenceId differs from the kept row's are never
+merged, since update_address looks addresses up by referenceId.
+"""
+
+import argparse
+import json
+import re
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from bson import ObjectId
+from rapidfuzz import fuzz
+from rapidfuzz.process import cdist
+
+from utils.full_state_name import normalize_state
+
+DEFAULT_THRESHOLD = 90
+# Rows scored per cdist call, bounds memory to CHUNK_ROWS * block size bytes
+CHUNK_ROWS = 2000
+DELETE_BATCH = 1000
+
+_word_pattern = re.compile(r"[a-z0-9]+")
+_directionals = {
+    "n": "n",
+    "north": "n",
+    "s": "s",
+    "south": "s",
+    "e": "e",
+    "east": "e",
+    "w": "w",
+    "west": "w",
+    "ne": "ne",
+    "northeast": "ne",
+    "nw": "nw",
+    "northwest": "nw",
+    "se": "se",
+    "southeast": "se",
+    "sw": "sw",
+    "southwest": "sw",
+}
+_suffixes = {
+    "st": "st",
+    "str": "st",
+    "street": "st",
+    "ave": "ave",
+    "av": "ave",
+    "avenue": "ave",
+    "rd": "rd",
+    "road": "rd",
+    "dr": "dr",
+    "drive": "dr",
+    "ln": "ln",
+    "lane": "ln",
+    "blvd": "blvd",
+    "boulevard": "blvd",
+    "ct": "ct",
+    "court": "ct",
+    "pl": "pl",
+    "place": "pl",
+    "cir": "cir",
+    "circle": "cir",
+    "pkwy": "pkwy",
+    "parkway": "pkwy",
+    "hwy": "hwy",
+    "highway": "hwy",
+    "ter": "ter",
+    "terrace": "ter",
+    "trl": "trl",
+    "trail": "trl",
+    "way": "way",
+    "sq": "sq",
+    "square": "sq",
+    "plz": "plz",
+    "plaza": "plz",
+    "expy": "expy",
+    "expressway": "expy",
+    "fwy": "fwy",
+    "freeway": "fwy",
+}
+_unit_designators = {
+    "apt": "apt",
+    "apartment": "apt",
+    "unit": "unit",
+    "ste": "ste",
+    "suite": "ste",
+    "fl": "fl",
+    "floor": "fl",
+    "rm": "rm",
+    "room": "rm",
+    "bldg": "bldg",
+    "building": "bldg",
+}
+
+
+def _words(text):
+    text = (text or "").lower().replace("#", " unit ")
+    words = _word_pattern.findall(text)
+    # "north east" is one directional, same as "northeast"
+    joined = []
+    for word in words:
+        if joined and joined[-1] in ("north", "south") and word in ("east", "west"):
+            joined[-1] += word
+        else:
+            joined.append(word)
+    return joined
+
+
+def parse_address(doc):
+    """
+    Split an address into the parts that must match exactly and the text that is
+    scored: returns ((house number, pre-directional, suffix, post-directional,
+    units, other numbers), street name).
+    """
+    words = _words(doc.get("addressLine1")) + _words(doc.get("addressLine2"))
+    house = None
+    if words and any(c.isdigit() for c in words[0]):
+        house = words.pop(0)
+
+    units, rest = [], []
+    idx = 0
+    while idx < len(words):
+        word = words[idx]
+        if word in _unit_designators and idx + 1 < len(words):
+            units.append(_unit_designators[word] + " " + words[idx + 1])
+            idx += 2
+            continue
+        rest.append(word)
+        idx += 1
+
+    # A directional or suffix that is the only word left is the street name
+    # itself, as in "123 North St" or "10 Court Rd"
+    pre = suffix = post = None
+    if len(rest) > 1 and rest[-1] in _directionals:
+        post = _directionals[rest.pop()]
+    if len(rest) > 1 and rest[-1] in _suffixes:
+        suffix = _suffixes[rest.pop()]
+    if len(rest) > 1 and rest[0] in _directionals:
+        pre = _directionals[rest.pop(0)]
+
+    numbers = [word for word in rest if any(c.isdigit() for c in word)]
+    street = [word for word in rest if not any(c.isdigit() for c in word)]
+    # Numbered streets ("E 4th St") have no name text left, score the number then
+    text = " ".join(street or numbers)
+    return (house, pre, suffix, post, tuple(units), tuple(numbers)), text
+
+
+def block_key(doc, exact=None):
+    """Blocking key: partition state, five digit zip and the exact address parts."""
+    if exact is None:
+        exact, _ = parse_address(doc)
+    state = normalize_state(doc.get("stateProv")) or ""
+    zip5 = (doc.get("postalCode") or "")[:5]
+    return (state, zip5) + exact
+
+
+def _canonical_rank(row):
+    # Prefer ZIP+4, then addresses with a referenceId, then the oldest document
+    _id, _, postal_code, reference_id, _ = row
+    return (
+        0 if postal_code and len(postal_code) > 5 else 1,
+        0 if reference_id is not None else 1,
+        ObjectId(_id),
+    )
+
+
+def score_block(job):
+    """
+    Score the rows of one block and return its merge clusters.
+
+    Runs inside a worker process, so `job` only carries plain picklable data:
+    (block key, rows of (id, street name, postalCode, referenceId, collection),
+    threshold). Rows are visited in canonical order; each unassigned row keeps
+    every later unassigned row that scores within the threshold against it.
+    """
+    key, rows, threshold = job
+    rows = sorted(rows, key=_canonical_rank)
+    strings = [row[1] for row in rows]
+    assigned = [False] * len(rows)
+
+    clusters = []
+    for start in range(0, len(rows), CHUNK_ROWS):
+        scores = cdist(
+            strings[start : start + CHUNK_ROWS],
+            strings,
+            scorer=fuzz.token_sort_ratio,
+            score_cutoff=threshold,
+            dtype=np.uint8,
+        )
+        for offset, row_scores in enumerate(scores):
+            i = start + offset
+            if assigned[i]:
+                continue
+            assigned[i] = True
+            keep = rows[i]
+            members = []
+            for j in np.nonzero(row_scores)[0]:
+                if j <= i or assigned[j]:
+                    continue
+                reference_id = rows[j][3]
+                if reference_id is not None and reference_id != keep[3]:
+                    continue
+                assigned[j] = True
+                members.append(rows[j])
+            if members:
+                clusters.append(
+                    {
+                        "block": list(key),
+                        "keep": keep[0],
+                        "duplicates": [
+                            {"_id": row[0], "collection": row[4]} for row in members
+                        ],
+                        "addresses": [keep[1]] + [row[1] for row in members],
+                    }
+                )
+    return clusters
+
+
+def load_blocks(collections, query=None):
+    """Stream the address collections once and group the projected rows by blocking key."""
+    blocks = defaultdict(list)
+    projection = {
+        "addressLine1": 1,
+        "addressLine2": 1,
+        "stateProv": 1,
+        "postalCode": 1,
+        "referenceId": 1,
+    }
+    for collection in collections:
+        cursor = collection.find(query or {}, projection, batch_size=10000)
+        for doc in cursor:
+            exact, text = parse_address(doc)
+            blocks[block_key(doc, exact)].append(
+                (
+                    str(doc["_id"]),
+                    text,
+                    doc.get("postalCode"),
+                    doc.get("referenceId"),
+                    collection.name,
+                )
+            )
+    return blocks
+
+
+def find_clusters(blocks, threshold=DEFAULT_THRESHOLD, workers=None):
+    """Score all blocks with more than one address on a process pool."""
+    jobs = [(key, rows, threshold) for key, rows in blocks.items() if len(rows) > 1]
+    # Largest blocks first so one slow block does not trail at the end
+    jobs.sort(key=lambda job: -len(job[1]))
+    clusters = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for block_clusters in pool.map(score_block, jobs, chunksize=16):
+            clusters.extend(block_clusters)
+    return clusters
+
+
+def apply_clusters(clusters):
+    """Delete every duplicate from the collection it was read from."""
+    from db.connection import db
+
+    duplicate_ids = defaultdict(list)
+    for cluster in clusters:
+        for duplicate in cluster["duplicates"]:
+            duplicate_ids[duplicate["collection"]].append(ObjectId(duplicate["_id"]))
+
+    deleted = 0
+    for name, ids in duplicate_ids.items():
+        for start in range(0, len(ids), DELETE_BATCH):
+            batch = ids[start : start + DELETE_BATCH]
+            deleted += db[name].delete_many({"_id": {"$in": batch}}).deleted_count
+    if deleted:
+        # Invalidate listing ETags and cached bodies held by the API workers
+        from utils.etag import bump_version
+
+        bump_version()
+    return deleted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--threshold",
+        type=int,
+        default=DEFAULT_THRESHOLD,
+        help="minimum token_sort_ratio (0-100) for two addresses to be merged",
+    )
+    parser.add_argument("--workers", type=int, default=None, help="process pool size")
+    parser.add_argument("--state", help="only process one state, e.g. TX")
+    parser.add_argument("--report", help="write every cluster to this JSONL file")
+    parser.add_argument(
+        "--apply", action="store_true", help="delete duplicates instead of a dry run"
+    )
+    args = parser.parse_args(argv)
+
+    # Imported here so the scoring helpers can be used without a database
+    from db import partitions
+
+    if args.state:
+        query = {"stateProv": args.state.upper()}
+        collections = partitions.route(query)
+    else:
+        query, collections = None, partitions.all_collections()
+    blocks = load_blocks(collections, query)
+    clusters = find_clusters(blocks, args.threshold, args.workers)
+
+    if args.report:
+        with open(args.report, "w") as report:
+            for cluster in clusters:
+                report.write(json.dumps(cluster) + "\n")
+
+    summary = {
+        "mode": "apply" if args.apply else "dry-run",
+        "addresses": sum(len(rows) for rows in blocks.values()),
+        "blocks": len(blocks),
+        "clusters": len(clusters),
+        "duplicates": sum(len(c["duplicates"]) for c in clusters),
+    }
+    if args.apply:
+        summary["deleted"] = apply_clusters(clusters)
+
+    json.dump(summary, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
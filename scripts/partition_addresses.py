@@ -0,0 +1,99 @@
+"""
+Copy the single addresses collection into per-state partitions.
+
+Usage:
+    python -m scripts.partition_addresses                # copy, safe to re-run
+    python -m scripts.partition_addresses --drop-source  # copy, verify counts, drop `addresses`
+
+Documents keep their _id, so a re-run after an interruption skips what was
+already copied. Start the API with ADDRESS_PARTITIONING=state once the copy
+has been verified.
+"""
+
+import argparse
+import json
+import sys
+from collections import defaultdict
+
+from pymongo.errors import BulkWriteError
+
+from db.connection import db, collection
+from db.partitions import partition_name, ensure_indexes, PARTITION_PREFIX
+
+BATCH_SIZE = 5000
+DUPLICATE_KEY = 11000
+
+
+def _flush(pending, copied):
+    for name, documents in pending.items():
+        target = db[name]
+        ensure_indexes(target)
+        try:
+            result = target.insert_many(documents, ordered=False)
+            copied[name] += len(result.inserted_ids)
+        except BulkWriteError as e:
+            # Already copied by an earlier run, anything else is a real failure
+            errors = e.details.get("writeErrors", [])
+            if any(error["code"] != DUPLICATE_KEY for error in errors):
+                raise
+            copied[name] += e.details.get("nInserted", 0)
+    pending.clear()
+
+
+def migrate(source, batch_size=BATCH_SIZE):
+    """Copy every document of `source` into its state partition, return copies per partition."""
+    pending = defaultdict(list)
+    copied = defaultdict(int)
+    buffered = 0
+    for doc in source.find({}, batch_size=batch_size):
+        pending[partition_name(doc.get("stateProv"))].append(doc)
+        buffered += 1
+        if buffered >= batch_size:
+            _flush(pending, copied)
+            buffered = 0
+    _flush(pending, copied)
+    return dict(copied)
+
+
+def partition_count():
+    names = db.list_collection_names(
+        filter={"name": {"$regex": "^" + PARTITION_PREFIX}}
+    )
+    return sum(db[name].estimated_document_count() for name in names)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "--drop-source",
+        action="store_true",
+        help="drop the addresses collection once every document is in a partition",
+    )
+    args = parser.parse_args(argv)
+
+    copied = migrate(collection, args.batch_size)
+    source_total = collection.count_documents({})
+    partitioned_total = partition_count()
+
+    summary = {
+        "source": source_total,
+        "partitioned": partitioned_total,
+        "copied_this_run": copied,
+    }
+
+    if args.drop_source:
+        if partitioned_total < source_total:
+            summary["dropped_source"] = False
+            summary["error"] = "partitions hold fewer documents than the source"
+        else:
+            collection.drop()
+            summary["dropped_source"] = True
+
+    json.dump(summary, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 1 if "error" in summary else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
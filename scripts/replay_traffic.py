@@ -0,0 +1,236 @@
+"""
+Replay captured traffic against one or two running builds.
+
+Usage:
+    python -m scripts.replay_traffic capture.jsonl --target http://localhost:5000 \\
+        --api-key KEY --admin-user USER --admin-pass PASS
+    python -m scripts.replay_traffic capture.jsonl --target http://localhost:5000 \\
+        --compare http://localhost:5001 --rate 2 --concurrency 16 --api-key KEY
+
+Records come from the capture middleware (TRAFFIC_CAPTURE_PATH). Requests are
+sent at their recorded spacing divided by --rate (0 sends as fast as the
+workers allow). Start the builds with RATELIMIT_ENABLED=false so the per-hour
+limits do not turn the replay into 429s.
+
+Captured address digits are redacted, so most replayed verify requests miss the
+exact-match lookup and take the near-match path. Latencies are also reported by
+the outcome each request had when it was captured, which makes that skew visible.
+"""
+
+import argparse
+import base64
+import json
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Fields that legitimately differ between two runs of the same request
+VOLATILE_FIELDS = {"time_created", "time_updated", "time_deleted", "fail_time"}
+
+
+def load_records(path, limit=None):
+    """Read a capture file, skipping lines that are not complete records."""
+    records = []
+    with open(path, encoding="utf-8") as capture:
+        for line in capture:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(record, dict) or not {"ts", "method", "path"} <= record.keys():
+                continue
+            records.append(record)
+            if limit and len(records) >= limit:
+                break
+    records.sort(key=lambda record: record["ts"])
+    return records
+
+
+def build_request(base_url, record, headers):
+    query = urllib.parse.urlencode(record.get("args") or {}, doseq=True)
+    url = base_url.rstrip("/") + record["path"] + ("?" + query if query else "")
+    data = None
+    if record.get("body") is not None:
+        data = json.dumps(record["body"]).encode("utf-8")
+    return urllib.request.Request(
+        url,
+        data=data,
+        method=record["method"],
+        headers={**headers, "Content-Type": "application/json"},
+    )
+
+
+def send(request, timeout):
+    """Return (status, parsed body or raw text, latency ms)."""
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status, raw = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, raw = e.code, e.read()
+    except (urllib.error.URLError, TimeoutError) as e:
+        status, raw = 0, str(e).encode("utf-8")
+    elapsed = (time.perf_counter() - start) * 1000
+    try:
+        body = json.loads(raw)
+    except ValueError:
+        body = raw.decode("utf-8", "replace")
+    return status, body, elapsed
+
+
+def strip_volatile(value):
+    if isinstance(value, dict):
+        return {
+            key: strip_volatile(item)
+            for key, item in value.items()
+            if key not in VOLATILE_FIELDS
+        }
+    if isinstance(value, list):
+        return [strip_volatile(item) for item in value]
+    return value
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {}
+
+    def pick(pct):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * pct))], 2)
+
+    return {
+        "count": len(latencies),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": round(latencies[-1], 2),
+        "mean": round(statistics.fmean(latencies), 2),
+    }
+
+
+def replay(records, targets, headers_for, rate, concurrency, timeout):
+    """
+    Send every record to every target, keeping the recorded spacing scaled by
+    `rate`. Returns latencies per (target, path, captured outcome) and the
+    response diffs.
+    """
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    diffs = []
+    lock = threading.Lock()
+
+    def run(record):
+        results = []
+        for target in targets:
+            request = build_request(target, record, headers_for(record))
+            status, body, elapsed = send(request, timeout)
+            results.append((status, body))
+            with lock:
+                outcome = record.get("outcome") or "unknown"
+                latencies[(target, record["path"], outcome)].append(elapsed)
+                statuses[target][status] += 1
+        if len(results) == 2:
+            baseline, candidate = results
+            if (baseline[0], strip_volatile(baseline[1])) != (
+                candidate[0],
+                strip_volatile(candidate[1]),
+            ):
+                with lock:
+                    diffs.append(
+                        {
+                            "path": record["path"],
+                            "args": record.get("args"),
+                            "body": record.get("body"),
+                            "baseline": {"status": baseline[0], "body": baseline[1]},
+                            "candidate": {"status": candidate[0], "body": candidate[1]},
+                        }
+                    )
+
+    first_ts = records[0]["ts"] if records else 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for record in records:
+            if rate > 0:
+                delay = (record["ts"] - first_ts) / rate - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(run, record)
+
+    return latencies, statuses, diffs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("capture", help="JSONL file written by the capture middleware")
+    parser.add_argument("--target", required=True, help="base URL of the build")
+    parser.add_argument("--compare", help="base URL of a second build to diff against")
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=1.0,
+        help="speed-up over the recorded rate, 0 sends as fast as possible",
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--limit", type=int, help="replay only the first N records")
+    parser.add_argument("--api-key", help="API key sent to the verify endpoint")
+    parser.add_argument("--admin-user", help="basic auth user for the listing endpoint")
+    parser.add_argument("--admin-pass", help="basic auth password for the listing")
+    parser.add_argument("--diff-file", help="write every differing response as JSONL")
+    args = parser.parse_args(argv)
+
+    basic = None
+    if args.admin_user:
+        credentials = f"{args.admin_user}:{args.admin_pass or ''}".encode("utf-8")
+        basic = "Basic " + base64.b64encode(credentials).decode("ascii")
+
+    def headers_for(record):
+        if record["path"].startswith("/api/v1/verify"):
+            return {"Authorization": args.api_key} if args.api_key else {}
+        return {"Authorization": basic} if basic else {}
+
+    records = load_records(args.capture, args.limit)
+    targets = [args.target] + ([args.compare] if args.compare else [])
+    latencies, statuses, diffs = replay(
+        records, targets, headers_for, args.rate, args.concurrency, args.timeout
+    )
+
+    by_path = defaultdict(list)
+    for (target, path, _), values in latencies.items():
+        by_path[(target, path)].extend(values)
+
+    report = {
+        "records": len(records),
+        "latency_ms": {
+            f"{target} {path}": percentiles(values)
+            for (target, path), values in sorted(by_path.items())
+        },
+        "latency_ms_by_captured_outcome": {
+            f"{target} {path} {outcome}": percentiles(values)
+            for (target, path, outcome), values in sorted(latencies.items())
+        },
+        "status_codes": {target: dict(codes) for target, codes in statuses.items()},
+    }
+    if args.compare:
+        report["diffs"] = len(diffs)
+
+    if args.diff_file:
+        with open(args.diff_file, "w", encoding="utf-8") as out:
+            for diff in diffs:
+                out.write(json.dumps(diff) + "\n")
+
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
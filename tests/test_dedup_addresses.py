@@ -0,0 +1,110 @@
+from bson import ObjectId
+
+from scripts.dedup_addresses import load_blocks, score_block, DEFAULT_THRESHOLD
+
+
+class FakeCollection:
+    def __init__(self, name, docs):
+        self.name = name
+        self.docs = docs
+
+    def find(self, query, projection, batch_size=None):
+        return iter(self.docs)
+
+
+def address(line1, line2=None, reference_id=None, postal_code="77002"):
+    return {
+        "_id": ObjectId(),
+        "addressLine1": line1,
+        "addressLine2": line2,
+        "city": "Houston",
+        "stateProv": "TX",
+        "postalCode": postal_code,
+        "referenceId": reference_id,
+    }
+
+
+def clusters_for(docs, name="addresses"):
+    blocks = load_blocks([FakeCollection(name, docs)])
+    clusters = []
+    for key, rows in blocks.items():
+        clusters.extend(score_block((key, rows, DEFAULT_THRESHOLD)))
+    return clusters
+
+
+def test_different_house_numbers_are_not_merged():
+    docs = [
+        address("123 Main Street"),
+        address("124 Main St"),
+        address("125 Main St"),
+    ]
+    assert clusters_for(docs) == []
+
+
+def test_different_units_are_not_merged():
+    docs = [
+        address("4500 Oak Ave Apt 1"),
+        address("4500 Oak Ave Apt 2"),
+        address("4500 Oak Ave Apt 12"),
+    ]
+    assert clusters_for(docs) == []
+
+
+def test_different_units_in_address_line2_are_not_merged():
+    docs = [address("4500 Oak Ave", "Apt 1"), address("4500 Oak Ave", "Apt 12")]
+    assert clusters_for(docs) == []
+
+
+def test_suffix_case_and_zip4_variants_are_merged():
+    kept = address("123 Main Street", postal_code="77002-1234")
+    duplicates = [address("123 MAIN ST"), address("123 main st.")]
+    clusters = clusters_for([duplicates[0], kept, duplicates[1]], name="addresses_TX")
+
+    assert len(clusters) == 1
+    assert clusters[0]["keep"] == str(kept["_id"])
+    assert sorted(d["_id"] for d in clusters[0]["duplicates"]) == sorted(
+        str(doc["_id"]) for doc in duplicates
+    )
+    assert {d["collection"] for d in clusters[0]["duplicates"]} == {"addresses_TX"}
+
+
+def test_rows_with_a_different_reference_id_are_never_deleted():
+    docs = [
+        address("123 Main Street", reference_id=1),
+        address("123 Main St", reference_id=2),
+    ]
+    assert clusters_for(docs) == []
+
+
+def test_duplicates_are_scored_against_the_kept_row_only():
+    # b is within the threshold of both a and c, but a and c are not close enough
+    a = ("000000000000000000000001", "abcdefghij", "77002", None, "addresses")
+    b = ("000000000000000000000002", "abcdefghxy", "77002", None, "addresses")
+    c = ("000000000000000000000003", "abcdefwzxy", "77002", None, "addresses")
+    clusters = score_block((("TX", "77002"), [a, b, c], 80))
+
+    assert [cluster["keep"] for cluster in clusters] == [a[0]]
+    assert [d["_id"] for d in clusters[0]["duplicates"]] == [b[0]]
+
+
+def test_different_directionals_suffixes_and_names_are_not_merged():
+    pairs = [
+        ("123 N Main St", "123 S Main St"),
+        ("123 North Main St", "123 South Main St"),
+        ("500 Elm St NW", "500 Elm St NE"),
+        ("500 Elm St North West", "500 Elm St NE"),
+        ("123 E 4th St", "123 W 4th St"),
+        ("123 Main St", "123 Main Ave"),
+        ("123 Main St", "123 Maine St"),
+    ]
+    for first, second in pairs:
+        assert clusters_for([address(first), address(second)]) == [], (first, second)
+
+
+def test_spelled_out_directionals_and_numbered_streets_are_merged():
+    pairs = [
+        ("500 Elm St NW", "500 Elm Street North West"),
+        ("123 E 4th St", "123 East 4th Street"),
+    ]
+    for first, second in pairs:
+        assert len(clusters_for([address(first), address(second)])) == 1, (first, second)
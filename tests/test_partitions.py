@@ -0,0 +1,89 @@
+import importlib
+import sys
+import types
+
+import pytest
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, sort):
+        field = sort[0][0]
+        self.docs = sorted(self.docs, key=lambda doc: doc[field], reverse=True)
+        return self
+
+    def limit(self, limit):
+        self.docs = self.docs[:limit]
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+class FakeCollection:
+    """Holds (text score, document) pairs and answers textScore sorted finds."""
+
+    def __init__(self, name, scored):
+        self.name = name
+        self.scored = scored
+        self.projections = []
+
+    def find(self, query, projection=None, **kwargs):
+        self.projections.append(projection)
+        docs = []
+        for score, doc in self.scored:
+            doc = dict(doc)
+            for field, value in (projection or {}).items():
+                if value == {"$meta": "textScore"}:
+                    doc[field] = score
+            docs.append(doc)
+        return FakeCursor(docs)
+
+
+class FakeDb(dict):
+    def list_collection_names(self, filter=None):
+        return list(self)
+
+
+@pytest.fixture
+def partitions(monkeypatch):
+    fake_db = FakeDb(
+        addresses_AK=FakeCollection(
+            "addresses_AK",
+            [(1.1, {"addressLine1": "1 Main St"}), (1.0, {"addressLine1": "2 Main"})],
+        ),
+        addresses_TX=FakeCollection(
+            "addresses_TX",
+            [
+                (3.0, {"addressLine1": "100 Main St"}),
+                (2.5, {"addressLine1": "101 Main St"}),
+                (2.0, {"addressLine1": "102 Main St"}),
+            ],
+        ),
+    )
+    connection = types.ModuleType("db.connection")
+    connection.db = fake_db
+    connection.collection = None
+    monkeypatch.setitem(sys.modules, "db.connection", connection)
+    monkeypatch.setenv("ADDRESS_PARTITIONING", "state")
+    monkeypatch.delitem(sys.modules, "db.partitions", raising=False)
+    return importlib.import_module("db.partitions")
+
+
+def test_text_search_across_partitions_is_merged_by_score(partitions):
+    documents = partitions.find(
+        {"$text": {"$search": "main"}},
+        {"_id": 0},
+        sort=[("score", {"$meta": "textScore"})],
+        limit=3,
+    )
+
+    assert documents == [
+        {"addressLine1": "100 Main St"},
+        {"addressLine1": "101 Main St"},
+        {"addressLine1": "102 Main St"},
+    ]
+    projections = partitions.db["addresses_TX"].projections
+    assert projections == [{"_id": 0, "score": {"$meta": "textScore"}}]
@@ -0,0 +1,146 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from functools import wraps
+from flask import g, request
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+# Latency budget (ms) for a request when neither the endpoint nor the API key sets one
+DEFAULT_BUDGET_MS = int(os.getenv("REQUEST_BUDGET_MS", 1500))
+
+# Per endpoint overrides, e.g. ENDPOINT_BUDGETS_MS="verify_address=800,get_list_of_addresses=3000"
+ENDPOINT_BUDGETS_MS = {
+    name.strip(): int(ms)
+    for name, ms in (
+        item.split("=")
+        for item in os.getenv("ENDPOINT_BUDGETS_MS", "").split(",")
+        if "=" in item
+    )
+}
+
+# Near-match searches allowed to run at once across all workers on this host. prod.sh
+# runs 4 sync gunicorn workers, each serving one request at a time; keeping this below
+# the worker count leaves workers free for exact-match traffic
+NEAR_MATCH_CONCURRENCY = int(os.getenv("NEAR_MATCH_CONCURRENCY", 2))
+NEAR_MATCH_SLOT_DIR = os.getenv("NEAR_MATCH_SLOT_DIR", tempfile.gettempdir())
+
+# $text candidates ranked per near-match search, and when the budget is short
+NEAR_MATCH_LIMIT = int(os.getenv("NEAR_MATCH_LIMIT", 200))
+NEAR_MATCH_TRUNCATED_LIMIT = int(os.getenv("NEAR_MATCH_TRUNCATED_LIMIT", 25))
+
+# Least maxTimeMS the exact-match lookup gets, even once the budget is spent
+EXACT_MATCH_MIN_MS = int(os.getenv("EXACT_MATCH_MIN_MS", 500))
+
+# Seconds a near-match latency sample counts towards the estimate
+NEAR_MATCH_LATENCY_MAX_AGE = float(os.getenv("NEAR_MATCH_LATENCY_MAX_AGE", 60))
+
+
+class SlotPool:
+    """
+    Non-blocking slots shared by every process on the host: slot i is an exclusive
+    flock on <dir>/avs-near-match-<i>.lock, released when its descriptor is closed,
+    so a crashed worker never leaks one. Falls back to a per-process semaphore where
+    fcntl is missing (Windows dev machines).
+    """
+
+    def __init__(self, size, directory):
+        self.paths = [
+            os.path.join(directory, f"avs-near-match-{i}.lock") for i in range(size)
+        ]
+        self._semaphore = threading.BoundedSemaphore(size) if fcntl is None else None
+
+    def acquire(self):
+        """Return a slot token, or None when every slot is taken."""
+        if self._semaphore is not None:
+            return True if self._semaphore.acquire(blocking=False) else None
+        for path in self.paths:
+            # A new descriptor per attempt, so threads of one process also exclude
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def release(self, token):
+        if self._semaphore is not None:
+            self._semaphore.release()
+        else:
+            os.close(token)
+
+
+near_match_slots = SlotPool(NEAR_MATCH_CONCURRENCY, NEAR_MATCH_SLOT_DIR)
+
+
+class LatencyTracker:
+    """
+    Rolling window of observed latencies (ms) used to predict the next one.
+    Samples older than `max_age` seconds are dropped, so an estimate pushed up by
+    a slow spell comes back down even when nothing new is observed.
+    """
+
+    def __init__(self, window=200, max_age=NEAR_MATCH_LATENCY_MAX_AGE):
+        self.max_age = max_age
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed_ms):
+        with self._lock:
+            self._samples.append((time.monotonic(), elapsed_ms))
+
+    def percentile(self, pct=90):
+        oldest = time.monotonic() - self.max_age
+        with self._lock:
+            while self._samples and self._samples[0][0] < oldest:
+                self._samples.popleft()
+            samples = sorted(elapsed for _, elapsed in self._samples)
+        if not samples:
+            return 0.0
+        idx = min(len(samples) - 1, int(len(samples) * pct / 100))
+        return samples[idx]
+
+
+near_match_latency = LatencyTracker()
+
+
+def request_budget(func=None, *, default_ms=DEFAULT_BUDGET_MS):
+    """
+    Functionality:
+    Start the latency budget for the request. An API key's `budget_ms` (set by
+    require_api_key) wins over the endpoint budget, which wins over `default_ms`.
+    With `default_ms=None` the request only gets a budget when one is configured.
+
+    """
+    if func is None:
+        return lambda func: request_budget(func, default_ms=default_ms)
+
+    @wraps(func)
+    def start_budget(*args, **kwargs):
+        endpoint = (request.endpoint or "").rsplit(".", 1)[-1]
+        budget_ms = g.get("api_key_budget_ms") or ENDPOINT_BUDGETS_MS.get(
+            endpoint, default_ms
+        )
+        if budget_ms:
+            g.deadline = time.monotonic() + budget_ms / 1000
+        return func(*args, **kwargs)
+
+    return start_budget
+
+
+def remaining_ms():
+    """Milliseconds left in the current request budget, never below zero."""
+    deadline = g.get("deadline")
+    if deadline is None:
+        return DEFAULT_BUDGET_MS
+    return max(0, int((deadline - time.monotonic()) * 1000))
@@ -0,0 +1,140 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import atexit
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import queue
+import random
+import re
+import secrets
+import threading
+import time
+from flask import g, request
+
+# Opt-in: traffic is only captured when a path is set
+CAPTURE_PATH = os.getenv("TRAFFIC_CAPTURE_PATH")
+# Fraction of verify/listing requests written to the capture file
+CAPTURE_SAMPLE_RATE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE_RATE", 0.01))
+CAPTURED_ENDPOINTS = {"avs_routes.verify_address", "avs_routes.get_list_of_addresses"}
+
+# Key for the digit redaction. Never written to the capture; without it set, each
+# process uses a random key, so the same address is redacted differently per worker
+CAPTURE_SECRET = (
+    os.getenv("TRAFFIC_CAPTURE_SECRET", "").encode("utf-8") or secrets.token_bytes(32)
+)
+
+# Records waiting for the writer; when full new records are dropped, never awaited
+QUEUE_SIZE = 10000
+
+_digits = re.compile(r"\d")
+
+
+def _redact_digits(value):
+    """
+    Replace every digit with one derived from a keyed HMAC of the value, so house
+    and unit numbers are gone but the format and repeat frequency of an address
+    stay. Without the key the original digits cannot be brute-forced back.
+    """
+    if not isinstance(value, str):
+        return value
+    digest = hmac.new(CAPTURE_SECRET, value.encode("utf-8"), hashlib.sha256).hexdigest()
+    digits = itertools.cycle(str(int(digest, 16)))
+    return _digits.sub(lambda _: next(digits), value)
+
+
+def redact(data, fields=("addressLine1", "addressLine2")):
+    """Strip personal data from a request body or query args before it is written to disk."""
+    if not isinstance(data, dict):
+        return data
+    redacted = dict(data)
+    for field in fields:
+        if isinstance(redacted.get(field), list):
+            redacted[field] = [_redact_digits(value) for value in redacted[field]]
+        elif field in redacted:
+            redacted[field] = _redact_digits(redacted[field])
+    return redacted
+
+
+class CaptureWriter:
+    """
+    Appends records to a JSONL file from a background thread. Every gunicorn
+    worker appends to the same file, so each record goes out as one O_APPEND
+    write, which keeps lines from different workers apart; a short write is
+    finished with further writes rather than leaving the line cut off.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    return
+                line = (json.dumps(record, default=str) + "\n").encode("utf-8")
+                # os.write may write less than asked, e.g. when interrupted
+                while line:
+                    line = line[os.write(fd, line) :]
+        finally:
+            os.close(fd)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
+def init_capture(app):
+    """Register the capture hooks on `app` when TRAFFIC_CAPTURE_PATH is set."""
+    if not CAPTURE_PATH:
+        return None
+
+    writer = CaptureWriter(CAPTURE_PATH)
+
+    @app.before_request
+    def start_capture():
+        if (
+            request.endpoint in CAPTURED_ENDPOINTS
+            and random.random() < CAPTURE_SAMPLE_RATE
+        ):
+            g.capture_started = time.monotonic()
+
+    @app.after_request
+    def finish_capture(response):
+        started = g.get("capture_started")
+        if started is None:
+            return response
+        writer.write(
+            {
+                "ts": time.time(),
+                "method": request.method,
+                "path": request.path,
+                "args": redact(request.args.to_dict(flat=False), fields=("search",)),
+                "body": redact(request.get_json(silent=True)),
+                "status": response.status_code,
+                # Redacted digits rarely match exactly on replay, so keep the
+                # original outcome to compare replayed latencies against
+                "outcome": g.get("usage_outcome", f"http_{response.status_code}"),
+                "latency_ms": round((time.monotonic() - started) * 1000, 3),
+            }
+        )
+        return response
+
+    return writer
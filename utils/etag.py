@@ -0,0 +1,97 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from pymongo import ReturnDocument
+from db.connection import db
+
+counter_collection = db["counters"]
+
+ADDRESS_COUNTER_ID = "addresses"
+
+# Seconds a worker trusts its cached collection version before re-reading it, this
+# bounds how long another worker's write can go unnoticed by this worker's ETags
+VERSION_TTL = float(os.getenv("ADDRESS_VERSION_TTL", 2))
+
+# Serialized listing bodies kept per worker, least recently used evicted first
+LISTING_CACHE_SIZE = int(os.getenv("LISTING_CACHE_SIZE", 256))
+# Bodies larger than this are served but never cached
+LISTING_CACHE_MAX_ENTRY_BYTES = int(
+    os.getenv("LISTING_CACHE_MAX_ENTRY_BYTES", 256 * 1024)
+)
+# Total bytes of cached bodies per worker
+LISTING_CACHE_MAX_BYTES = int(
+    os.getenv("LISTING_CACHE_MAX_BYTES", 16 * 1024 * 1024)
+)
+
+_lock = threading.Lock()
+_version = {"value": None, "checked": 0.0}
+_listing_cache = OrderedDict()
+_listing_cache_bytes = {"total": 0}
+
+
+def current_version():
+    """Collection version, served from memory and refreshed at most every VERSION_TTL seconds."""
+    now = time.monotonic()
+    with _lock:
+        if _version["value"] is not None and now - _version["checked"] < VERSION_TTL:
+            return _version["value"]
+
+    counter = counter_collection.find_one({"_id": ADDRESS_COUNTER_ID})
+    value = counter["version"] if counter else 0
+    with _lock:
+        _version["value"] = value
+        _version["checked"] = now
+    return value
+
+
+def bump_version():
+    """Increment the collection version after any write to the addresses collection."""
+    counter = counter_collection.find_one_and_update(
+        {"_id": ADDRESS_COUNTER_ID},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    with _lock:
+        _version["value"] = counter["version"]
+        _version["checked"] = time.monotonic()
+    return counter["version"]
+
+
+def make_etag(query_key, version):
+    """Strong ETag for one normalized listing query at one collection version."""
+    return hashlib.sha1(f"{version}:{query_key}".encode("utf-8")).hexdigest()
+
+
+def get_cached_listing(query_key, etag):
+    """Return the cached (body, mimetype) for the query if it was built for this ETag."""
+    with _lock:
+        entry = _listing_cache.get(query_key)
+        if entry is None or entry[0] != etag:
+            return None
+        _listing_cache.move_to_end(query_key)
+        return entry[1], entry[2]
+
+
+def cache_listing(query_key, etag, body, mimetype):
+    with _lock:
+        previous = _listing_cache.pop(query_key, None)
+        if previous is not None:
+            _listing_cache_bytes["total"] -= len(previous[1])
+        if len(body) > LISTING_CACHE_MAX_ENTRY_BYTES:
+            return
+
+        _listing_cache[query_key] = (etag, body, mimetype)
+        _listing_cache_bytes["total"] += len(body)
+        while _listing_cache and (
+            len(_listing_cache) > LISTING_CACHE_SIZE
+            or _listing_cache_bytes["total"] > LISTING_CACHE_MAX_BYTES
+        ):
+            _, evicted = _listing_cache.popitem(last=False)
+            _listing_cache_bytes["total"] -= len(evicted[1])
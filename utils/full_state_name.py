@@ -1,3 +1,5 @@
+import re
+
 state_names = {
     "Alabama": "AL",
     "Alaska": "AK",
@@ -62,3 +64,13 @@ misc_abbreviation = {
     "lane": "ln",
     "avenue": "ave",
 }
+
+
+def normalize_state(state):
+    """Two letter state code used as partition key, full state names are abbreviated."""
+    if not isinstance(state, str) or not state.strip():
+        return None
+    state = state.strip()
+    if len(state) > 2:
+        state = state_names.get(state.title(), state)
+    return re.sub(r"[^A-Za-z0-9]", "", state).upper() or None
@@ -0,0 +1,74 @@
+import math
+from datetime import date, datetime
+from bson import ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+def _default(obj):
+    """Encode the Mongo types our documents carry, then fall back to Flask's encoder."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    return DefaultJSONProvider.default(obj)
+
+
+def _has_non_finite(obj):
+    """True if `obj` holds NaN or Infinity, which orjson would write as null."""
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(_has_non_finite(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(_has_non_finite(value) for value in obj)
+    return False
+
+
+def _orjson_dumps(obj):
+    """orjson bytes, or None when only the stdlib encoder gives the same output."""
+    try:
+        body = orjson.dumps(obj, default=_default, option=orjson.OPT_SORT_KEYS)
+    except orjson.JSONEncodeError:
+        # e.g. integers over 64 bits
+        return None
+    # orjson writes NaN/Infinity as null where the stdlib writes NaN/Infinity
+    if b"null" in body and _has_non_finite(obj):
+        return None
+    return body
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider for the app: orjson when it is installed, otherwise the stdlib
+    encoder. Both encode ObjectId and datetime natively, so routes can return Mongo
+    documents without converting `_id` first.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            # Flask sorts keys by default; keep that so key order does not change
+            body = _orjson_dumps(obj)
+            if body is not None:
+                return body.decode("utf-8")
+        kwargs.setdefault("default", _default)
+        return super().dumps(obj, **kwargs)
+
+    # loads stays on the stdlib: orjson rejects NaN/Infinity and turns integers
+    # over 64 bits into floats, which would change how request bodies parse
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if orjson is None or self.compact is False or (
+            self.compact is None and self._app.debug
+        ):
+            return super().response(*args, **kwargs)
+
+        body = _orjson_dumps(obj)
+        if body is None:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
@@ -0,0 +1,110 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import atexit
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError, BulkWriteError
+from db.connection import db
+
+usage_collection = db["api_usage"]
+usage_collection.create_index([("api_key", 1), ("day", 1)])
+
+# Seconds between flushes, also the most usage a crashed worker can lose
+FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", 5))
+
+
+class UsageAccountant:
+    """
+    Counts requests per (api key, endpoint, outcome, day) in memory and writes
+    them to Mongo from a background thread with batched $inc upserts, so the
+    request path only does a dict increment.
+    """
+
+    def __init__(self, target, interval=FLUSH_INTERVAL):
+        self.target = target
+        self.interval = interval
+        self._counts = defaultdict(int)
+        self._day = (None, None)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, api_key, endpoint, outcome):
+        # Formatting a date per request costs more than the count itself
+        day_number = int(time.time() // 86400)
+        if day_number != self._day[0]:
+            day = datetime.fromtimestamp(day_number * 86400, timezone.utc)
+            self._day = (day_number, day.strftime("%Y-%m-%d"))
+        day = self._day[1]
+        with self._lock:
+            self._counts[(api_key, endpoint, outcome, day)] += 1
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, defaultdict(int)
+        if not counts:
+            return 0
+
+        totals = defaultdict(lambda: defaultdict(int))
+        for (api_key, endpoint, outcome, day), count in counts.items():
+            totals[(api_key, endpoint, day)][outcome] += count
+
+        groups = list(totals.items())
+        operations = [
+            UpdateOne(
+                {"api_key": api_key, "endpoint": endpoint, "day": day},
+                {
+                    "$inc": {
+                        "total": sum(outcomes.values()),
+                        **{f"outcomes.{o}": n for o, n in outcomes.items()},
+                    }
+                },
+                upsert=True,
+            )
+            for (api_key, endpoint, day), outcomes in groups
+        ]
+        try:
+            self.target.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Only the failed upserts are retried, the others were applied
+            failed = [groups[error["index"]] for error in e.details["writeErrors"]]
+            self._restore(failed)
+            raise
+        except PyMongoError:
+            self._restore(groups)
+            raise
+        return len(operations)
+
+    def _restore(self, groups):
+        """Put counts that did not reach Mongo back for the next flush."""
+        with self._lock:
+            for (api_key, endpoint, day), outcomes in groups:
+                for outcome, count in outcomes.items():
+                    self._counts[(api_key, endpoint, outcome, day)] += count
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except PyMongoError:
+                pass
+
+    def close(self):
+        """Stop the flush thread and write what is left, called on worker shutdown."""
+        self._stop.set()
+        self._thread.join(timeout=self.interval)
+        try:
+            self.flush()
+        except PyMongoError:
+            pass
+
+
+usage = UsageAccountant(usage_collection)